@@ -2,9 +2,17 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import plotly.io as pio
 import sqlite3
+import hashlib
+import os
+import threading
 from io import BytesIO
 from datetime import datetime
+from riskvault_kernels import bf_counts
+
+# Serialize Plotly figures with orjson (used by st.plotly_chart on every rerun)
+pio.json.config.default_engine = "orjson"
 
 # ------------------------------
 # ⚙️ PAGE CONFIGURATION
@@ -76,117 +84,363 @@ brute_attempts = st.sidebar.number_input("Brute-force attempts threshold", 2, 10
 # ------------------------------
 # 🧾 LOAD DATA
 # ------------------------------
+REQUIRED_COLS = {"timestamp", "source_ip", "event_type"}
+EXPECTED_COLS = ["timestamp", "event_type", "source_ip", "destination_ip", "src_port", "dst_port", "username", "message"]
+SCHEMA = {
+    "event_type": "category",
+    "source_ip": "category",
+    "destination_ip": "category",
+    "username": "string[pyarrow]",
+    "message": "string[pyarrow]",
+}
+
+
+# Helper columns added by the loader for detection; kept out of Dashboard views and exports
+INTERNAL_COLS = ["is_failed"]
+
+
+def category_contains(s: pd.Series, pat: str) -> np.ndarray:
+    # Match once per unique label, then broadcast back through the category codes
+    s = s.astype("category")
+    hits = np.asarray(s.cat.categories.astype(str).str.contains(pat, case=False, regex=False, na=False))
+    return np.append(hits, False)[s.cat.codes.to_numpy()]  # code -1 (missing) -> False
+
+
+def parse_logs(file_bytes: bytes) -> pd.DataFrame:
+    try:
+        df = pd.read_csv(BytesIO(file_bytes), engine="pyarrow")
+    except pd.errors.ParserError:
+        # PyArrow rejects ragged rows; the C engine pads them with NaN like before
+        df = pd.read_csv(BytesIO(file_bytes))
+    # Cast after the read so a blank cell in an untyped integer column can't fail the parse
+    df = df.astype({c: t for c, t in SCHEMA.items() if c in df})
+    if REQUIRED_COLS - set(df.columns):
+        return df
+
+    df = df.reindex(columns=EXPECTED_COLS + [c for c in df.columns if c not in EXPECTED_COLS], fill_value=pd.NA)
+    # PyArrow already types clean ISO timestamps; only fall back to parsing strings,
+    # trying the ISO8601 fast path first and inferring per value for anything it missed
+    if not pd.api.types.is_datetime64_any_dtype(df["timestamp"]):
+        raw = df["timestamp"]
+        ts = pd.to_datetime(raw, format="ISO8601", errors="coerce", cache=True)
+        retry = ts.isna() & raw.notna()
+        if retry.any():
+            ts.loc[retry] = pd.to_datetime(raw[retry].astype(str), format="mixed", errors="coerce")
+        df["timestamp"] = ts
+    df = df.dropna(subset=["timestamp"])
+    df["is_failed"] = category_contains(df["event_type"], "fail")
+    return df.sort_values("timestamp")
+
+
+@st.cache_data
+def load_logs(file_bytes: bytes) -> pd.DataFrame:
+    return parse_logs(file_bytes)
+
+
+@st.cache_data
+def load_demo(path: str, mtime: float) -> pd.DataFrame:
+    # mtime is only part of the cache key, so editing the file invalidates it.
+    # Parse directly so the frame lives in this cache only, not in load_logs' too
+    with open(path, "rb") as f:
+        return parse_logs(f.read())
+
+
 if uploaded_file:
-    df = pd.read_csv(uploaded_file)
+    df = load_logs(uploaded_file.getvalue())
     st.sidebar.success(f"✅ Loaded {len(df)} events from uploaded file")
 elif use_demo:
-    df = pd.read_csv("sample_logs.csv")
+    df = load_demo("sample_logs.csv", os.path.getmtime("sample_logs.csv"))
     st.sidebar.info("ℹ️ Using demo dataset")
 else:
     st.warning("Please upload a CSV or use demo data to proceed.")
     st.stop()
 
 # ✅ Verify essential columns exist
-required_cols = {"timestamp", "source_ip", "event_type"}
-missing = required_cols - set(df.columns)
+missing = REQUIRED_COLS - set(df.columns)
 if missing:
     st.error(f"❌ Missing required columns in uploaded data: {', '.join(missing)}")
     st.stop()
 
-df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-df = df.dropna(subset=["timestamp"])
-df = df.sort_values("timestamp")
-
 # ------------------------------
 # 🧮 RISK CALCULATION
 # ------------------------------
-def risk_factors(event):
-    if "fail" in str(event).lower():
-        return 8, 5, detectability
-    elif "conn" in str(event).lower():
-        return 8, 5, detectability
-    elif "process" in str(event).lower():
-        return 9, 3, detectability
-    else:
-        return 2, 3, detectability
-
-df[["Severity", "Probability", "Detectability"]] = df["event_type"].apply(lambda x: pd.Series(risk_factors(x)))
-df["RPN"] = df["Severity"] * df["Probability"] * df["Detectability"]
-df["Risk_Level"] = pd.cut(df["RPN"], bins=[0, 100, critical_rpn, np.inf], labels=["Low", "Moderate", "Critical"])
-
-# ------------------------------
-# 📊 PAGE 1: DASHBOARD
-# ------------------------------
-if page == "Dashboard":
-    st.title("🛡️ Nexora RiskVault – SOC Risk Management Dashboard")
-    st.caption("AMDEC + Attack Detection | Nexora Technologies © 2025")
-
-    total_events = len(df)
-    critical_events = len(df[df["RPN"] > critical_rpn])
-    unique_sources = df["source_ip"].nunique()
-    avg_rpn = df["RPN"].mean().round(1)
-
-    col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Total Events", total_events)
-    col2.metric("Critical Events (RPN > 200)", critical_events)
-    col3.metric("Unique Sources", unique_sources)
-    col4.metric("Average RPN", avg_rpn)
+RISK_LEVELS = ["Low", "Moderate", "Critical"]
+
+
+def risk_level(rpn, critical_rpn: int) -> pd.Categorical:
+    rpn = np.asarray(rpn)
+    codes = np.digitize(rpn, [100, max(critical_rpn, 100)], right=True)
+    codes[rpn > critical_rpn] = 2  # thresholds below 100 skip the Moderate band
+    return pd.Categorical.from_codes(codes, categories=RISK_LEVELS, ordered=True)
+
+
+@st.cache_data
+def score(df: pd.DataFrame, detectability: int, critical_rpn: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Score each unique event type once, then gather per row through the category codes
+    event_type = df["event_type"].astype("category")
+    labels = event_type.cat.categories.astype(str).str.lower()
+    fail_conn = np.asarray(labels.str.contains("fail", regex=False) | labels.str.contains("conn", regex=False))
+    proc = np.asarray(labels.str.contains("process", regex=False))
+    conds = [fail_conn, proc]
+
+    sev_lut = np.append(np.select(conds, [8, 9], default=2), 2).astype(np.int8)  # last slot: missing event_type
+    prob_lut = np.append(np.select(conds, [5, 3], default=3), 3).astype(np.int8)
+    codes = event_type.cat.codes.to_numpy()
+    df["Severity"] = sev_lut[codes]
+    df["Probability"] = prob_lut[codes]
+    df["Detectability"] = np.int8(detectability)
+    df["RPN"] = df["Severity"].astype(np.int16) * df["Probability"] * df["Detectability"]
+    df["Risk_Level"] = risk_level(df["RPN"], critical_rpn)
 
     # 🔧 Aggregate AMDEC summary
     amdec_summary = (
-        df.groupby("event_type")
-        .agg({
-            "Severity": "mean",
-            "Probability": "mean",
-            "Detectability": "mean",
-            "RPN": "mean",
-            "source_ip": "nunique",
-            "event_type": "count"
-        })
-        .rename(columns={"event_type": "occurrences", "source_ip": "unique_sources"})
+        df.groupby("event_type", observed=True, sort=False)
+        .agg(
+            Severity=("Severity", "mean"),
+            Probability=("Probability", "mean"),
+            Detectability=("Detectability", "mean"),
+            RPN=("RPN", "mean"),
+            unique_sources=("source_ip", "nunique"),
+            occurrences=("RPN", "size"),
+        )
         .reset_index()
     )
 
     # ✅ FIX: Add Risk_Level back to summary
-    amdec_summary["Risk_Level"] = pd.cut(
-        amdec_summary["RPN"],
-        bins=[0, 100, critical_rpn, np.inf],
-        labels=["Low", "Moderate", "Critical"]
-    )
+    amdec_summary["Risk_Level"] = risk_level(amdec_summary["RPN"], critical_rpn)
+    return df, amdec_summary
+
+
+# Under NUMBA_DISABLE_JIT the kernel would run as plain Python, so use pandas instead
+USE_NUMBA = os.getenv("NUMBA_DISABLE_JIT", "0") == "0"
+
+
+@st.cache_data
+def detect_attacks(df: pd.DataFrame, window: int, attempts: int) -> tuple[pd.DataFrame, list[str]]:
+    is_failed = df["is_failed"].to_numpy()
+
+    # 🔁 Failed logins per source within the sliding brute-force window
+    failed = df.loc[is_failed].sort_values(["source_ip", "timestamp"], kind="stable")
+    sources = failed["source_ip"].astype("category")
+    codes = sources.cat.codes.to_numpy()
+    n_codes = len(sources.cat.categories)
+    if USE_NUMBA:
+        bf_count, peak_attempts = bf_counts(
+            codes,
+            failed["timestamp"].to_numpy("datetime64[ns]").view("int64"),
+            window * 1_000_000_000,
+            n_codes,
+        )
+    else:
+        # Group on the integer codes: rows without an IP (-1) keep their own group,
+        # and sort=False keeps groups in row order since each code is contiguous
+        bf_count = (
+            pd.Series(failed["is_failed"].to_numpy(), index=failed["timestamp"])
+            .groupby(codes, sort=False)
+            .rolling(f"{window}s")
+            .count()
+            .to_numpy()
+        )
+        if bf_count.size != len(failed):
+            raise ValueError(f"rolling count returned {bf_count.size} values for {len(failed)} failed logins")
+        peak_attempts = np.zeros(n_codes + 1)
+        np.maximum.at(peak_attempts, codes, bf_count)
+        peak_attempts = peak_attempts[:n_codes]
+    df.loc[failed.index, "bf_count"] = bf_count
+
+    suspicious_ips = sources.cat.categories[peak_attempts >= attempts].astype(str).tolist()
+    return df, suspicious_ips
+
+
+@st.cache_data(show_spinner=False)
+def build_excel(df: pd.DataFrame, amdec_summary: pd.DataFrame) -> bytes:
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        df.drop(columns=INTERNAL_COLS).to_excel(writer, sheet_name="Logs", index=False)
+        amdec_summary.to_excel(writer, sheet_name="AMDEC Summary", index=False)
+    return buffer.getvalue()
 
-    # 📊 Charts
-    st.subheader("📊 Risk Distribution by Event Type")
-    fig1 = px.bar(
-        amdec_summary,
+
+@st.cache_data(show_spinner=False)
+def build_parquet(df: pd.DataFrame) -> bytes:
+    buffer = BytesIO()
+    df.drop(columns=INTERNAL_COLS).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+DB_COLS = EXPECTED_COLS + ["Severity", "Probability", "Detectability", "RPN", "Risk_Level", "event_key"]
+
+
+def format_ts(ts: pd.Series) -> pd.Series:
+    return ts.dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def canonical_value(v) -> str:
+    # 22, 22.0 and np.int64(22) must all give the same text, whatever dtype the reader picked
+    if v is None or v is pd.NA or (isinstance(v, (float, np.floating)) and np.isnan(v)):
+        return ""
+    if isinstance(v, (float, np.floating)) and float(v).is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def event_keys(rows: pd.DataFrame) -> list[int]:
+    # Stable 64-bit digest of the raw log fields (timestamp already formatted by format_ts),
+    # so same-second attempts from one source stay distinct while re-syncing overlapping
+    # exports, at any detectability, inserts nothing new
+    return [
+        int.from_bytes(
+            hashlib.blake2b("\x1f".join(map(canonical_value, values)).encode(), digest_size=8).digest(),
+            "big",
+            signed=True,
+        )
+        for values in rows[EXPECTED_COLS].itertuples(index=False, name=None)
+    ]
+
+
+@st.cache_resource
+def get_conn() -> tuple[sqlite3.Connection, threading.Lock]:
+    # One shared handle across reruns and sessions; PRAGMAs and schema are applied once.
+    # The lock serializes sessions so one sync's transaction never absorbs another's work
+    conn = sqlite3.connect("riskvault.db", check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS logs ({', '.join(DB_COLS)})")
+
+        # 🔧 Older databases were written by to_sql: add any missing columns
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(logs)")}
+        for col in DB_COLS:
+            if col not in existing:
+                conn.execute(f"ALTER TABLE logs ADD COLUMN {col}")
+
+        # ... then key every stored row, dropping the copies appended on every page visit
+        has_key_index = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'logs_event_digest'"
+        ).fetchone()
+        if not has_key_index:
+            # Earlier keys: (timestamp, source_ip, event_type), then a dtype-dependent hash
+            conn.execute("DROP INDEX IF EXISTS logs_event_key")
+            conn.execute("DROP INDEX IF EXISTS logs_event_hash")
+
+            stored = pd.read_sql(f"SELECT rowid, {', '.join(EXPECTED_COLS)} FROM logs", conn)
+            parsed = pd.to_datetime(stored["timestamp"], format="mixed", errors="coerce")
+            stored["timestamp"] = format_ts(parsed).fillna(stored["timestamp"])
+            stored = stored.astype(object).where(stored.notna(), None)
+            stored["event_key"] = event_keys(stored)
+
+            dup = stored["event_key"].duplicated().to_numpy()
+            conn.executemany("DELETE FROM logs WHERE rowid = ?", ((r,) for r in stored.loc[dup, "rowid"]))
+            conn.executemany(
+                "UPDATE logs SET timestamp = ?, event_key = ? WHERE rowid = ?",
+                stored.loc[~dup, ["timestamp", "event_key", "rowid"]].itertuples(index=False, name=None),
+            )
+            conn.execute("CREATE UNIQUE INDEX logs_event_digest ON logs(event_key)")
+        conn.execute("CREATE INDEX IF NOT EXISTS logs_ts ON logs(timestamp)")
+    return conn, threading.Lock()
+
+
+def to_db_rows(df: pd.DataFrame) -> pd.DataFrame:
+    rows = df[DB_COLS[:-1]].assign(timestamp=format_ts(df["timestamp"]))
+    rows = rows.astype(object).where(rows.notna(), None)
+    rows["event_key"] = event_keys(rows)
+    return rows
+
+
+# ------------------------------
+# 🧩 DASHBOARD FRAGMENTS (rerun on their own widget changes)
+# ------------------------------
+@st.cache_data(show_spinner=False)
+def bar_fig(amdec_summary: pd.DataFrame):
+    return px.bar(
+        amdec_summary.nlargest(20, "RPN"),
         x="RPN", y="event_type",
         color="Risk_Level",
         orientation="h",
         color_discrete_map={"Low": "#10B981", "Moderate": "#F59E0B", "Critical": "#EF4444"}
     )
-    st.plotly_chart(fig1, use_container_width=True)
 
-    st.subheader("🎯 Risk Composition")
-    fig2 = px.pie(
+
+@st.cache_data(show_spinner=False)
+def pie_fig(amdec_summary: pd.DataFrame):
+    return px.pie(
         amdec_summary,
         names="Risk_Level",
         hole=0.4,
         color_discrete_map={"Low": "#10B981", "Moderate": "#F59E0B", "Critical": "#EF4444"}
     )
-    st.plotly_chart(fig2, use_container_width=True)
 
-    st.subheader("AMDEC Summary")
-    st.dataframe(amdec_summary, use_container_width=True)
 
+@st.fragment
+def show_plots(amdec_summary: pd.DataFrame):
+    st.subheader("📊 Risk Distribution by Event Type")
+    st.plotly_chart(bar_fig(amdec_summary), use_container_width=True)
+
+    st.subheader("🎯 Risk Composition")
+    st.plotly_chart(pie_fig(amdec_summary), use_container_width=True)
+
+
+@st.fragment
+def show_logs(df: pd.DataFrame):
     st.subheader("Event Logs (Filtered)")
     risk_filter = st.multiselect("Select Risk Levels", options=df["Risk_Level"].unique(), default=list(df["Risk_Level"].unique()))
-    st.dataframe(df[df["Risk_Level"].isin(risk_filter)], use_container_width=True)
+    mask = df["Risk_Level"].isin(risk_filter).to_numpy()
+    top = df["RPN"][mask].nlargest(500).index
+    st.dataframe(df.loc[top].drop(columns=INTERNAL_COLS), use_container_width=True, height=400)
+    st.caption(f"{int(mask.sum()):,} matching events; top 500 by RPN shown")
+
+    # Full filtered slice goes to a file instead of the browser table
+    if st.button("📄 Prepare Filtered Events Export"):
+        st.download_button(
+            "📥 Download Filtered Events (CSV)",
+            data=df.loc[mask].drop(columns=INTERNAL_COLS).to_csv(index=False),
+            file_name="nexora_riskvault_filtered_events.csv",
+        )
 
-    # 💾 Export
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-        df.to_excel(writer, sheet_name="Logs", index=False)
-        amdec_summary.to_excel(writer, sheet_name="AMDEC Summary", index=False)
-    st.download_button("📥 Download Excel Report", data=buffer.getvalue(), file_name="nexora_riskvault_report.xlsx")
+
+df, amdec_summary = score(df, detectability, critical_rpn)
+
+# ------------------------------
+# 📊 PAGE 1: DASHBOARD
+# ------------------------------
+if page == "Dashboard":
+    st.title("🛡️ Nexora RiskVault – SOC Risk Management Dashboard")
+    st.caption("AMDEC + Attack Detection | Nexora Technologies © 2025")
+
+    rpn = df["RPN"].to_numpy()
+    ip_codes = df["source_ip"].astype("category").cat.codes.to_numpy()
+    total_events = rpn.size
+    critical_events = int(np.count_nonzero(rpn > critical_rpn))
+    unique_sources = np.count_nonzero(np.bincount(ip_codes[ip_codes >= 0]))
+    avg_rpn = round(float(rpn.mean()), 1)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Total Events", total_events)
+    col2.metric("Critical Events (RPN > 200)", critical_events)
+    col3.metric("Unique Sources", unique_sources)
+    col4.metric("Average RPN", avg_rpn)
+
+    # 📊 Charts
+    show_plots(amdec_summary)
+
+    st.subheader("AMDEC Summary")
+    st.dataframe(amdec_summary, use_container_width=True)
+
+    show_logs(df)
+
+    # 💾 Export (built only on request, cached per dataset)
+    if st.button("📄 Prepare Excel Report"):
+        st.download_button(
+            "📥 Download Excel Report",
+            data=build_excel(df, amdec_summary),
+            file_name="nexora_riskvault_report.xlsx",
+        )
+    if st.button("📦 Prepare Parquet Export"):
+        st.download_button(
+            "📥 Download Logs (Parquet)",
+            data=build_parquet(df),
+            file_name="nexora_riskvault_logs.parquet",
+        )
 
 # ------------------------------
 # 📈 PAGE 2: ATTACK INTELLIGENCE
@@ -195,14 +449,7 @@ elif page == "Attack Intelligence":
     st.title("🧠 Threat & Attack Intelligence")
     st.caption("Live brute-force and anomaly detection")
 
-    df["is_failed"] = df["event_type"].str.contains("fail", case=False)
-    df["timestamp_diff"] = df["timestamp"].diff().dt.total_seconds().fillna(9999)
-
-    suspicious_ips = []
-    for ip, group in df[df["is_failed"]].groupby("source_ip"):
-        bursts = (group["timestamp_diff"] < brute_window).sum()
-        if bursts >= brute_attempts:
-            suspicious_ips.append(ip)
+    df, suspicious_ips = detect_attacks(df, brute_window, brute_attempts)
 
     if suspicious_ips:
         st.warning(f"⚠️ Brute-force activity detected from: {', '.join(suspicious_ips)}")
@@ -210,7 +457,9 @@ elif page == "Attack Intelligence":
         st.success("✅ No brute-force activity detected.")
 
     st.subheader("Recent Failed Logins")
-    st.dataframe(df[df["is_failed"]].sort_values("timestamp", ascending=False), use_container_width=True)
+    # df is already time-sorted ascending, so newest-first is just a reversed slice
+    recent_failed = df.loc[df["is_failed"]].iloc[::-1]
+    st.dataframe(recent_failed.head(500), use_container_width=True)
 
 # ------------------------------
 # 🗄️ PAGE 3: DATABASE VIEW
@@ -218,14 +467,22 @@ elif page == "Attack Intelligence":
 elif page == "Database View":
     st.title("🗄️ RiskVault Database Integration")
 
-    conn = sqlite3.connect("riskvault.db")
-    df.to_sql("logs", conn, if_exists="append", index=False)
-    st.success("✅ Logs saved to SQLite (riskvault.db)")
+    conn, db_lock = get_conn()
+
+    # 💾 Only write when asked; duplicates of already stored events are skipped
+    if st.button("💾 Sync logs to DB"):
+        rows = to_db_rows(df)
+        with db_lock, conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO logs ({', '.join(DB_COLS)}) VALUES ({', '.join('?' * len(DB_COLS))})",
+                rows.itertuples(index=False, name=None),
+            )
+        st.success("✅ Logs saved to SQLite (riskvault.db)")
 
-    db_data = pd.read_sql("SELECT * FROM logs LIMIT 50", conn)
+    with db_lock:
+        db_data = pd.read_sql("SELECT * FROM logs ORDER BY timestamp DESC LIMIT 50", conn)
     st.subheader("Last 50 Stored Entries")
     st.dataframe(db_data, use_container_width=True)
-    conn.close()
 
 # ------------------------------
 # ℹ️ PAGE 4: ABOUT
@@ -0,0 +1,25 @@
+import numpy as np
+from numba import njit
+
+# ------------------------------
+# ⚡ COMPILED KERNELS
+# ------------------------------
+# Kept out of app.py: Streamlit re-executes the script on every rerun, which would build a
+# fresh dispatcher (and reload the compiled kernel from disk) each time. An imported module
+# is loaded once per process, so the JIT-ed function stays warm across reruns.
+
+
+@njit(cache=True)
+def bf_counts(codes, ts_ns, window_ns, n_codes):
+    # Two-pointer sliding window over rows sorted by (source code, timestamp),
+    # tracking each source's peak count as we go (slot -1 collects missing IPs)
+    out = np.empty(ts_ns.size, np.int32)
+    peak = np.zeros(n_codes + 1, np.int32)
+    lo = 0
+    for i in range(ts_ns.size):
+        while codes[lo] != codes[i] or ts_ns[i] - ts_ns[lo] >= window_ns:
+            lo += 1
+        out[i] = i - lo + 1
+        if out[i] > peak[codes[i]]:
+            peak[codes[i]] = out[i]
+    return out, peak[:n_codes]